@@ -4,6 +4,7 @@ from nemo_asr.helpers import post_process_predictions, word_error_rate
 import numpy as np
 from nemo_asr.parts.features import WaveformFeaturizer
 from infer_datalayers import AudioInferDataLayer
+from telemetry import NullProfiler
 from nemo.core.neural_modules import NeuralModule
 from nemo.backends.pytorch.nm import DataLayerNM
 from nemo.core.neural_types import *
@@ -34,6 +35,7 @@ class JasperInference:
             self.neural_factory = nemo.core.NeuralModuleFactory(backend=nemo.core.Backend.PyTorch)
         self.model_definition = model_definition
         self.vocab = self.model_definition['labels']
+        self.profiler = NullProfiler()
         self.build_components(encoder_module=encoder_module,decoder_module=decoder_module)
         self.build_dag()
 
@@ -80,6 +82,21 @@ class JasperInference:
         self.predictions = self.greedy_decoder(log_probs=self.log_probs)
         # TODO:  Add support for N-gram LM model
 
+    def set_profiler(self,profiler):
+        """
+        Sets the profiler used to time each stage of inference, and attaches
+        it to the preprocessor, encoder, decoder and greedy decoder modules
+
+        Arguments:
+            profiler:  An instance of telemetry.Profiler or
+                telemetry.NullProfiler
+        """
+        self.profiler = profiler
+        profiler.attach('preprocessor',self.data_preprocessor)
+        profiler.attach('encoder',self.encoder)
+        profiler.attach('decoder',self.decoder)
+        profiler.attach('greedy_decoder',self.greedy_decoder)
+
     def restore_weights(self,encoder_weight_path=None,decoder_weight_path=None):
         """
         Set the weights of the encoder and/or decoder modules
@@ -115,21 +132,28 @@ class JasperInference:
                 greedy_transcript: The transcript form of the greedy prediction
                 logits: decoder output logits
         """
+        profiler = self.profiler
         if filepaths is not None:
             waveforms = []
-            for filepath in filepaths:
-                waveform,sr = librosa.core.load(filepath,sr=self.model_definition['sample_rate'])
-                waveforms.append(waveform)
-            self.data_layer.set_signal(waveforms)
-        elif waveforms is not None:
-            self.data_layer.set_signal(waveforms)
-        else:
+            with profiler.stage('load'):
+                for filepath in filepaths:
+                    waveform,sr = librosa.core.load(filepath,sr=self.model_definition['sample_rate'])
+                    waveforms.append(waveform)
+        elif waveforms is None:
             raise ValueError("Need filepaths or waveforms")
+        with profiler.stage('set_signal'):
+            self.data_layer.set_signal(waveforms)
+        if profiler.enabled:
+            signal_shape = self.data_layer.signal_shape
+            profiler.add('audio_seconds',signal_shape.sum()/self.model_definition['sample_rate'])
+            profiler.add('padded_seconds',self.data_layer.signal.size/self.model_definition['sample_rate'])
         tensors_to_evaluate = [self.predictions]
         if return_logits:
             tensors_to_evaluate.append(self.log_probs)
-        evaluated_tensors = self.neural_factory.infer(tensors_to_evaluate,verbose=False)
-        greedy_transcript = post_process_predictions(evaluated_tensors[0],self.vocab)
+        with profiler.stage('infer'):
+            evaluated_tensors = self.neural_factory.infer(tensors_to_evaluate,verbose=False)
+        with profiler.stage('post_process'):
+            greedy_transcript = post_process_predictions(evaluated_tensors[0],self.vocab)
         result_dict = {'greedy prediction':evaluated_tensors[0]}
         result_dict['greedy transcript']=greedy_transcript
         if return_logits:
@@ -13,6 +13,16 @@ extension
 -b : The inference batch size, larger values will take advantage of GPU
 acceleration better
 --use_cpu : boolean. If enabled, NeMo computations will be done on CPU
+-t : The number of audio files to read concurrently within a batch, defaults
+to 16.  On network mounted dataset roots this hides the latency of each read.
+-s : The memory, in megabytes, used to keep decoded source recordings,
+defaults to 512.  Each source recording is shared by many VOiCES recordings,
+so this avoids reading and decoding it again for every one of them.  A 30
+second source recording takes about 2 MB.
+--trace : Optional.  The filepath for a JSON lines trace with per-batch stage
+timings, audio seconds processed, real-time factor, padding ratio and peak RSS
+--cprofile : Optional.  The filepath for a cProfile stats dump of the whole run,
+in the pstats format read by the pstats module and snakeviz
 
 
 The output is a csv file with a row for each file and the following columns
@@ -31,21 +41,27 @@ ground truth
 
 import numpy as np
 import os
+import sys
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 from JasperModels import JasperInference
+from telemetry import Profiler, NullProfiler
 from ruamel.yaml import YAML
 import pesq
 import librosa
 from nemo_asr.helpers import post_process_predictions, word_error_rate
 import tqdm
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dataloaders.VOiCES_datasets import SourceAudioCache
 
 def batch(iterable, n=1):
     l = len(iterable)
     for ndx in range(0, l, n):
         yield iterable[ndx:min(ndx + n, l)]
 
-def process_batch(item_batch,dataset_root,jasper_model,sample_rate=16000):
+def process_batch(item_batch,dataset_root,jasper_model,sample_rate=16000,profiler=None,
+                  source_cache=None,executor=None):
     """
     Perform inference on and post-process a batch of VOiCES recordings
 
@@ -55,25 +71,47 @@ def process_batch(item_batch,dataset_root,jasper_model,sample_rate=16000):
         dataset_root:  The absolute path to the root of the dataset
         jasper_model:  An instance of the JasperInference class
         sample_rate:  The sample rate of the recordings
+        profiler:  Optional.  An instance of telemetry.Profiler used to time
+            each stage of the batch
+        source_cache:  Optional.  A SourceAudioCache used to load the source
+            recording of each item by its source_id.  By default every source
+            recording is read from disk.
+        executor:  Optional.  A concurrent.futures executor used to read all
+            of the noisy and clean audio files of the batch concurrently.  By
+            default they are read one after another.
     Returns:
         result_batch:  A list of dictionaries, with one for each item in
             item_batch.
     """
+    if profiler is None:
+        profiler = NullProfiler()
     result_batch = []
-    noisy_waveform_list = []
-    clean_waveform_list = []
-
-    for item in item_batch:
-        result_dict = {'query_name':item['query_name']}
-        result_dict['ground_truth']=item['transcript']
 
+    def load_noisy(item):
         noisy_filepath = os.path.join(dataset_root,item['filename'])
-        clean_filepath = os.path.join(dataset_root,item['source'])
-
         noisy_waveform,_ = librosa.load(noisy_filepath,sr=sample_rate)
-        noisy_waveform_list.append(noisy_waveform)
+        return noisy_waveform
+
+    def load_clean(item):
+        if source_cache is not None:
+            return source_cache[item['source_id']]
+        clean_filepath = os.path.join(dataset_root,item['source'])
         clean_waveform,_ = librosa.load(clean_filepath,sr=sample_rate)
-        clean_waveform_list.append(clean_waveform)
+        return clean_waveform
+
+    with profiler.stage('load'):
+        if executor is not None:
+            noisy_futures = [executor.submit(load_noisy,item) for item in item_batch]
+            clean_futures = [executor.submit(load_clean,item) for item in item_batch]
+            noisy_waveform_list = [future.result() for future in noisy_futures]
+            clean_waveform_list = [future.result() for future in clean_futures]
+        else:
+            noisy_waveform_list = [load_noisy(item) for item in item_batch]
+            clean_waveform_list = [load_clean(item) for item in item_batch]
+
+    for item in item_batch:
+        result_dict = {'query_name':item['query_name']}
+        result_dict['ground_truth']=item['transcript']
 
         #pesq_nb = pesq.pesq(16000,clean_waveform,noisy_waveform,'nb')
         #pesq_wb = pesq.pesq(16000,clean_waveform,noisy_waveform,'wb')
@@ -84,11 +122,12 @@ def process_batch(item_batch,dataset_root,jasper_model,sample_rate=16000):
     noisy_result = jasper_model.infer(waveforms=noisy_waveform_list)
     clean_result = jasper_model.infer(waveforms=clean_waveform_list)
 
-    for i in range(len(item_batch)):
-        result_batch[i]['noisy transcript'] = noisy_result['greedy transcript'][i]
-        result_batch[i]['clean transcript'] = clean_result['greedy transcript'][i]
-        result_batch[i]['noisy wer'] = word_error_rate([result_batch[i]['noisy transcript']],[result_batch[i]['ground_truth']])
-        result_batch[i]['clean wer'] = word_error_rate([result_batch[i]['clean transcript']],[result_batch[i]['ground_truth']])
+    with profiler.stage('word_error_rate'):
+        for i in range(len(item_batch)):
+            result_batch[i]['noisy transcript'] = noisy_result['greedy transcript'][i]
+            result_batch[i]['clean transcript'] = clean_result['greedy transcript'][i]
+            result_batch[i]['noisy wer'] = word_error_rate([result_batch[i]['noisy transcript']],[result_batch[i]['ground_truth']])
+            result_batch[i]['clean wer'] = word_error_rate([result_batch[i]['clean transcript']],[result_batch[i]['ground_truth']])
 
     return result_batch
 
@@ -108,8 +147,16 @@ if __name__ == '__main__':
                         default='none',type=str)
     parser.add_argument('-b',dest='BATCH_SIZE',help='batch size',
                         default=8,type=int)
+    parser.add_argument('-t',dest='IO_THREADS',help='number of files to read concurrently',
+                        default=16,type=int)
+    parser.add_argument('-s',dest='SOURCE_CACHE',help='megabytes of decoded source audio to cache',
+                        default=512,type=int)
     parser.add_argument('--use_cpu',dest='USE_CPU',action='store_true',
                         help='use the cpu')
+    parser.add_argument('--trace',dest='TRACE',help='out filepath for the telemetry trace',
+                        default='none',type=str)
+    parser.add_argument('--cprofile',dest='CPROFILE',help='out filepath for the cProfile stats',
+                        default='none',type=str)
     args = parser.parse_args()
 
     #load up the dataset
@@ -131,14 +178,38 @@ if __name__ == '__main__':
     jasper = JasperInference(model_definition,use_cpu=use_cpu)
     jasper.restore_weights(encoder_weight_path=args.ENCODER_PATH,decoder_weight_path=args.DECODER_PATH)
 
+    #set up telemetry, which is a no-op unless a trace or cProfile file is given
+    if args.TRACE != 'none' or args.CPROFILE != 'none':
+        trace_path = args.TRACE if args.TRACE != 'none' else None
+        cprofile_path = args.CPROFILE if args.CPROFILE != 'none' else None
+        profiler = Profiler(trace_path=trace_path,cprofile_path=cprofile_path,cuda_sync=not use_cpu)
+    else:
+        profiler = NullProfiler()
+    jasper.set_profiler(profiler)
+
+    #source recordings are shared by many items, so keep them decoded.  Index
+    #files built before the source_id column was added get IDs from the paths
+    if 'source_id' not in df.columns:
+        df = df.assign(source_id=pd.factorize(df['source'])[0])
+    source_cache = SourceAudioCache(args.DATASET_ROOT,df.drop_duplicates('source_id'),
+                                    max_bytes=args.SOURCE_CACHE*1024**2)
+
     #convert the dataframe to a list of dicts
     records = df.to_dict('records')
 
     #this will hold the processed items
     result_list = []
 
-    for item_batch in tqdm.tqdm(batch(records,n=args.BATCH_SIZE)):
-        result_batch = process_batch(item_batch,args.DATASET_ROOT,jasper)
-        result_list+=result_batch
+    #audio files are read concurrently within each batch.  The pool is shut
+    #down and the trace closed even if a batch fails
+    try:
+        with ThreadPoolExecutor(max_workers=args.IO_THREADS) as executor:
+            for item_batch in tqdm.tqdm(batch(records,n=args.BATCH_SIZE)):
+                with profiler.batch():
+                    result_batch = process_batch(item_batch,args.DATASET_ROOT,jasper,profiler=profiler,
+                                                 source_cache=source_cache,executor=executor)
+                result_list+=result_batch
+    finally:
+        profiler.close()
     result_df = pd.DataFrame(result_list)
     result_df.to_csv(args.OUTPUT)
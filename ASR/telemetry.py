@@ -0,0 +1,213 @@
+import sys
+import json
+import time
+import cProfile
+from collections import defaultdict
+import torch
+try:
+    import resource
+except ImportError:
+    # resource is unavailable on Windows, where peak RSS is not reported
+    resource = None
+
+def peak_rss_mb():
+    """
+    Returns the peak resident set size of this process in megabytes, or None
+    if it cannot be measured on this platform
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    if sys.platform=='darwin':
+        return peak/(1024*1024)
+    return peak/1024
+
+class _NullContext:
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        return False
+
+_NULL_CONTEXT = _NullContext()
+
+class NullProfiler:
+    """
+    A profiler that records nothing.  Every method is a no-op, and stage and
+    batch return a shared context manager, so instrumented code pays only for
+    a method call when profiling is disabled.
+    """
+    enabled = False
+
+    def stage(self,name):
+        return _NULL_CONTEXT
+
+    def batch(self):
+        return _NULL_CONTEXT
+
+    def add(self,name,value):
+        pass
+
+    def attach(self,name,module):
+        pass
+
+    def close(self):
+        pass
+
+class _Stage:
+    def __init__(self,profiler,name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self,*exc):
+        self.profiler._stop(self.name,self.start)
+        return False
+
+class _Batch:
+    def __init__(self,profiler):
+        self.profiler = profiler
+
+    def __enter__(self):
+        self.profiler._start_batch()
+        return self
+
+    def __exit__(self,*exc):
+        self.profiler._end_batch()
+        return False
+
+class Profiler:
+    """
+    Records per-batch timing and throughput telemetry for ASR inference, and
+    writes one JSON object per batch to a JSON lines trace file, if one is
+    given.
+
+    Each record has the following fields:
+        batch: The batch number, starting from 0
+        wall_seconds: Wall clock time spent on the batch
+        audio_seconds: Seconds of audio passed through the model
+        rtf: Real-time factor, wall_seconds/audio_seconds
+        padding_ratio: Fraction of the padded model input that is padding
+        peak_rss_mb: Peak resident set size of the process so far
+        stages: Dictionary of wall clock seconds spent in each named stage.
+            Stages may nest, e.g. 'infer' includes 'encoder'.
+
+    Arguments:
+        trace_path: Optional.  The path of the JSON lines trace file
+        cprofile_path: Optional.  If set, the whole run is also profiled with
+            cProfile and the stats are dumped to this path on close, in the
+            binary pstats format read by the pstats module and snakeviz.  For
+            a sampled flame graph, run the script under py-spy instead, e.g.
+            py-spy record --format speedscope -- python batch_asr_eval.py ...
+        cuda_sync: If true, CUDA is synchronized around attached modules, so
+            their timings include the GPU work they launch
+    """
+    enabled = True
+
+    def __init__(self,trace_path=None,cprofile_path=None,cuda_sync=False):
+        self.trace_file = open(trace_path,'w') if trace_path is not None else None
+        self.cprofile_path = cprofile_path
+        self.cuda_sync = cuda_sync and torch.cuda.is_available()
+        self.num_batches = 0
+        self.hooks = []
+        self._module_starts = {}
+        self._reset()
+        self.cprofiler = None
+        if cprofile_path is not None:
+            self.cprofiler = cProfile.Profile()
+            self.cprofiler.enable()
+
+    def _reset(self):
+        self.stages = defaultdict(float)
+        self.counters = defaultdict(float)
+        self.batch_start = None
+
+    def stage(self,name):
+        """
+        Returns a context manager that adds the time spent inside it to the
+        named stage of the current batch
+        """
+        return _Stage(self,name)
+
+    def batch(self):
+        """
+        Returns a context manager that delimits one batch, writing its record
+        to the trace on exit
+        """
+        return _Batch(self)
+
+    def add(self,name,value):
+        """
+        Adds value to a named counter of the current batch.  The counters
+        audio_seconds and padded_seconds are used to compute the rtf and
+        padding_ratio fields.
+        """
+        self.counters[name] += value
+
+    def attach(self,name,module):
+        """
+        Times every forward call of a torch module as the named stage, using
+        forward hooks.  NeMo modules that are not themselves torch modules are
+        timed through their featurizer, if they have one, and skipped
+        otherwise.
+        """
+        if not isinstance(module,torch.nn.Module):
+            module = getattr(module,'featurizer',None)
+            if not isinstance(module,torch.nn.Module):
+                return
+
+        def pre_hook(mod,inputs):
+            if self.cuda_sync:
+                torch.cuda.synchronize()
+            self._module_starts[name] = time.perf_counter()
+
+        def post_hook(mod,inputs,outputs):
+            if self.cuda_sync:
+                torch.cuda.synchronize()
+            self._stop(name,self._module_starts.pop(name))
+
+        self.hooks.append(module.register_forward_pre_hook(pre_hook))
+        self.hooks.append(module.register_forward_hook(post_hook))
+
+    def _stop(self,name,start):
+        self.stages[name] += time.perf_counter()-start
+
+    def _start_batch(self):
+        self._reset()
+        self.batch_start = time.perf_counter()
+
+    def _end_batch(self):
+        wall_seconds = time.perf_counter()-self.batch_start
+        audio_seconds = self.counters.pop('audio_seconds',0.0)
+        padded_seconds = self.counters.pop('padded_seconds',0.0)
+        record = {'batch':self.num_batches,
+                  'wall_seconds':wall_seconds,
+                  'audio_seconds':audio_seconds,
+                  'rtf':wall_seconds/audio_seconds if audio_seconds>0 else None,
+                  'padding_ratio':1.0-audio_seconds/padded_seconds if padded_seconds>0 else None,
+                  'peak_rss_mb':peak_rss_mb(),
+                  'stages':dict(self.stages)}
+        record.update(self.counters)
+        if self.trace_file is not None:
+            self.trace_file.write(json.dumps(record)+'\n')
+            self.trace_file.flush()
+        self.num_batches += 1
+        self._reset()
+
+    def close(self):
+        """
+        Removes the module hooks, closes the trace and dumps the cProfile
+        stats, if enabled
+        """
+        for hook in self.hooks:
+            hook.remove()
+        self.hooks = []
+        if self.trace_file is not None:
+            self.trace_file.close()
+        if self.cprofiler is not None:
+            self.cprofiler.disable()
+            self.cprofiler.dump_stats(self.cprofile_path)
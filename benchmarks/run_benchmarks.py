@@ -0,0 +1,278 @@
+"""
+This script times the main code paths of the toolkit against a synthetic
+VOiCES-shaped dataset, and writes the results as JSON so that runs can be
+compared over time.
+
+The following benchmarks are run:
+
+build_indices: Runs indexing_utils/build_indices.py end to end on the dataset
+build_nemo_manifest: trim_df, split_df and convert_df_to_manifest on every
+    split of the train index
+speaker_dataloader: One epoch of a DataLoader over VOiCES_SpeakerVerification
+    with PadSequence as the collate_fn
+set_signal: AudioInferDataLayer.set_signal on batches of waveforms with the
+    lengths of the train index recordings
+concurrent_loading: Reading batches of recordings one after another and with
+    ConcurrentAudioLoader, with a fixed latency added to every read to mimic a
+    network mounted dataset root
+
+Benchmarks whose dependencies (torch, librosa, nemo) are not installed are
+reported as skipped.
+
+The script takes in the following command line arguments:
+
+-d: Optional.  The path to an existing synthetic dataset, as written by
+    synthetic_dataset.py.  By default one is built in a temporary directory.
+-o: Optional.  The path for the JSON results.  By default they are printed.
+-n: The number of times each benchmark is repeated, defaults to 3
+-b: The batch size for the dataloader and set_signal benchmarks, defaults to 8
+-w: The number of DataLoader workers, defaults to 0
+-s: The number of speakers per split when building a dataset, defaults to 6
+-l: The latency, in milliseconds, added to every read in the
+    concurrent_loading benchmark, defaults to 5
+"""
+
+import os
+import sys
+import json
+import time
+import wave
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import numpy as np
+import pandas as pd
+from benchmarks.synthetic_dataset import build_synthetic_dataset
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def summarize(timings,**metrics):
+    """
+    Summarizes a list of wall clock timings, in seconds, as a dictionary with
+    any extra metrics added
+    """
+    summary = {'seconds':timings,'min':min(timings),'median':float(np.median(timings))}
+    summary.update(metrics)
+    return summary
+
+def skipped(reason):
+    return {'skipped':reason}
+
+def bench_build_indices(dataset_root,repeat):
+    """
+    Times build_indices.py as a subprocess, writing the index files to a
+    temporary directory
+    """
+    script = os.path.join(REPO_ROOT,'indexing_utils','build_indices.py')
+    index_dir = tempfile.mkdtemp()
+    timings = []
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable,script,'-r',dataset_root,'-i',index_dir],
+                           check=True,stdout=subprocess.DEVNULL)
+            timings.append(time.perf_counter()-start)
+        num_rows = sum(len(pd.read_csv(os.path.join(index_dir,name)))
+                       for name in ['train_index.csv','test_index.csv'])
+    finally:
+        shutil.rmtree(index_dir)
+    return summarize(timings,rows=num_rows,rows_per_second=num_rows/min(timings))
+
+def bench_build_nemo_manifest(dataset_root,df,repeat):
+    """
+    Times trimming and splitting an index and converting every split to a
+    NeMo manifest string
+    """
+    from indexing_utils.build_nemo_manifest import trim_df, split_df, convert_df_to_manifest
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        trimmed_df = trim_df(df,max_duration=30.0,drop_bad=True)
+        df_dict = split_df(trimmed_df)
+        for sub_df in df_dict.values():
+            convert_df_to_manifest(sub_df,dataset_root)
+        timings.append(time.perf_counter()-start)
+    return summarize(timings,rows=len(df),splits=len(df_dict))
+
+def bench_speaker_dataloader(dataset_root,df,repeat,batch_size,num_workers):
+    """
+    Times one epoch of loading and collating every recording in the index
+    """
+    try:
+        from torch.utils.data import DataLoader
+        from dataloaders.VOiCES_datasets import VOiCES_SpeakerVerification, PadSequence
+    except ImportError as e:
+        return skipped(str(e))
+    dataset = VOiCES_SpeakerVerification(dataset_root,df)
+    loader = DataLoader(dataset,batch_size=batch_size,shuffle=False,
+                        num_workers=num_workers,collate_fn=PadSequence())
+    audio_seconds = float(dataset.df['noisy_time'].sum())
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in loader:
+            pass
+        timings.append(time.perf_counter()-start)
+    return summarize(timings,items=len(dataset),
+                     items_per_second=len(dataset)/min(timings),
+                     audio_seconds_per_second=audio_seconds/min(timings))
+
+def bench_set_signal(df,repeat,batch_size):
+    """
+    Times padding batches of random waveforms into an AudioInferDataLayer
+    """
+    sys.path.insert(0,os.path.join(REPO_ROOT,'ASR'))
+    try:
+        from infer_datalayers import AudioInferDataLayer
+    except ImportError as e:
+        return skipped(str(e))
+    finally:
+        sys.path.pop(0)
+    rng = np.random.RandomState(0)
+    lengths = df['noisy_length'].values
+    signals = [rng.randn(length).astype(np.float32) for length in lengths]
+    batches = [signals[i:i+batch_size] for i in range(0,len(signals),batch_size)]
+    data_layer = AudioInferDataLayer(sample_rate=16000)
+    padded_samples = sum(len(b)*max(len(s) for s in b) for b in batches)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for signal_batch in batches:
+            data_layer.set_signal(signal_batch)
+        timings.append(time.perf_counter()-start)
+    return summarize(timings,batches=len(batches),
+                     padding_ratio=1.0-lengths.sum()/padded_samples)
+
+def read_wav(filepath,sr=16000):
+    """
+    Reads a 16 bit mono .wav file as written by synthetic_dataset.py, with the
+    signature of librosa.load
+    """
+    with wave.open(filepath,'rb') as fin:
+        pcm = np.frombuffer(fin.readframes(fin.getnframes()),dtype='<i2')
+        samplerate = fin.getframerate()
+    return pcm.astype(np.float32)/32768,samplerate
+
+def bench_concurrent_loading(dataset_root,df,repeat,batch_size,latency):
+    """
+    Times reading every recording in the index in batches, serially and with
+    ConcurrentAudioLoader, with latency seconds added to every read
+    """
+    try:
+        from dataloaders.VOiCES_datasets import ConcurrentAudioLoader
+    except ImportError as e:
+        return skipped(str(e))
+
+    def slow_read(filepath,sr=16000):
+        time.sleep(latency)
+        return read_wav(filepath,sr=sr)
+
+    filepaths = [os.path.join(dataset_root,filename) for filename in df['filename']]
+    batches = [filepaths[i:i+batch_size] for i in range(0,len(filepaths),batch_size)]
+    loader = ConcurrentAudioLoader(max_in_flight=batch_size,load_fn=slow_read)
+    serial_timings = []
+    concurrent_timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for filepath_batch in batches:
+            [slow_read(filepath) for filepath in filepath_batch]
+        serial_timings.append(time.perf_counter()-start)
+        start = time.perf_counter()
+        for filepath_batch in batches:
+            loader.load_many(filepath_batch)
+        concurrent_timings.append(time.perf_counter()-start)
+    return summarize(concurrent_timings,latency=latency,
+                     serial=summarize(serial_timings),
+                     speedup=min(serial_timings)/min(concurrent_timings))
+
+def environment():
+    """
+    Returns a dictionary describing the machine and code being benchmarked
+    """
+    try:
+        commit = subprocess.run(['git','rev-parse','HEAD'],cwd=REPO_ROOT,check=True,
+                                capture_output=True,text=True).stdout.strip()
+    except (OSError,subprocess.CalledProcessError):
+        commit = None
+    return {'commit':commit,'python':platform.python_version(),
+            'platform':platform.platform(),'cpu_count':os.cpu_count(),
+            'numpy':np.__version__,'pandas':pd.__version__}
+
+def run_benchmarks(dataset_root,repeat=3,batch_size=8,num_workers=0,latency=0.005):
+    """
+    Runs every benchmark against a synthetic dataset
+
+    Inputs:
+        dataset_root - The path to the root of a synthetic dataset
+        repeat - The number of times each benchmark is repeated
+        batch_size - The batch size for the dataloader and set_signal
+            benchmarks
+        num_workers - The number of DataLoader worker processes
+        latency - The seconds added to every read in the concurrent_loading
+            benchmark
+    Outputs:
+        results - A dictionary with the environment and the result of each
+            benchmark
+    """
+    dataset_root = os.path.join(dataset_root,'')
+    results = {'environment':environment(),
+               'config':{'repeat':repeat,'batch_size':batch_size,'num_workers':num_workers,
+                         'latency':latency},
+               'benchmarks':{}}
+    benchmarks = results['benchmarks']
+    benchmarks['build_indices'] = bench_build_indices(dataset_root,repeat)
+
+    # The remaining benchmarks run on a train index built once up front
+    index_dir = tempfile.mkdtemp()
+    try:
+        subprocess.run([sys.executable,os.path.join(REPO_ROOT,'indexing_utils','build_indices.py'),
+                        '-r',dataset_root,'-i',index_dir],check=True,stdout=subprocess.DEVNULL)
+        df = pd.read_csv(os.path.join(index_dir,'train_index.csv'),index_col='index')
+    finally:
+        shutil.rmtree(index_dir)
+    benchmarks['build_nemo_manifest'] = bench_build_nemo_manifest(dataset_root,df,repeat)
+    benchmarks['speaker_dataloader'] = bench_speaker_dataloader(dataset_root,df,repeat,
+                                                                batch_size,num_workers)
+    benchmarks['set_signal'] = bench_set_signal(df,repeat,batch_size)
+    benchmarks['concurrent_loading'] = bench_concurrent_loading(dataset_root,df,repeat,
+                                                                batch_size,latency)
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d',dest='DATASET_ROOT',help='Root of an existing synthetic dataset',
+                        default='none',type=str)
+    parser.add_argument('-o',dest='OUTPUT',help='Output path for the JSON results',
+                        default='none',type=str)
+    parser.add_argument('-n',dest='REPEAT',help='Number of repeats per benchmark',
+                        default=3,type=int)
+    parser.add_argument('-b',dest='BATCH_SIZE',help='batch size',
+                        default=8,type=int)
+    parser.add_argument('-w',dest='NUM_WORKERS',help='number of DataLoader workers',
+                        default=0,type=int)
+    parser.add_argument('-s',dest='NUM_SPEAKERS',help='Speakers per split for a built dataset',
+                        default=6,type=int)
+    parser.add_argument('-l',dest='LATENCY',help='Milliseconds added to every read when loading concurrently',
+                        default=5.0,type=float)
+    args = parser.parse_args()
+
+    if args.DATASET_ROOT=='none':
+        dataset_root = tempfile.mkdtemp()
+        build_synthetic_dataset(dataset_root,num_speakers=args.NUM_SPEAKERS)
+    else:
+        dataset_root = args.DATASET_ROOT
+    try:
+        results = run_benchmarks(dataset_root,repeat=args.REPEAT,batch_size=args.BATCH_SIZE,
+                                 num_workers=args.NUM_WORKERS,latency=args.LATENCY/1000)
+    finally:
+        if args.DATASET_ROOT=='none':
+            shutil.rmtree(dataset_root)
+
+    json_string = json.dumps(results,indent=2)
+    if args.OUTPUT=='none':
+        print(json_string)
+    else:
+        with open(args.OUTPUT,'w') as fout:
+            fout.write(json_string)
@@ -0,0 +1,158 @@
+"""
+This script builds a small synthetic dataset with the same directory layout,
+filename grammar and reference tables as the VOiCES release, filled with short
+random waveforms.  It is meant for timing the toolkit without the real corpus.
+
+The script takes in the following command line arguments:
+
+-o: The path to the root of the synthetic dataset, created if it does not exist
+-s: The number of speakers in each of the train and test splits, defaults to 6
+-g: The number of source segments per speaker, defaults to 3
+-m: The number of mics per room, defaults to 3
+--min_duration, --max_duration: The range of recording durations, in seconds,
+    defaults to 0.5 and 2.0
+--seed: The random seed, defaults to 0
+
+The dataset root will contain
+
+distant-16k/speech/<split>/<room>/<distractor>/sp<speaker>/*.wav: Noisy recordings
+source-16k/<split>/sp<speaker>/*.wav: Source audio
+references/Lab41-SRI-VOiCES-speaker-gender-dataset.tbl
+references/Lab41-SRI-VOiCES-speaker-book-chapter.tbl
+references/filename_transcripts
+references/time_values.csv
+"""
+
+import os
+import wave
+import argparse
+import numpy as np
+import pandas as pd
+
+ROOMS = ['rm1','rm2']
+DISTRACTORS = ['babb','musi','none','tele']
+WORDS = ['the','quick','brown','fox','jumps','over','lazy','dog','voices','room']
+
+def write_wav(filepath,waveform,sample_rate=16000):
+    """
+    Writes a float waveform in [-1, 1] to a 16 bit mono .wav file
+    """
+    pcm = (np.clip(waveform,-1.0,1.0)*32767).astype('<i2')
+    with wave.open(filepath,'wb') as fout:
+        fout.setnchannels(1)
+        fout.setsampwidth(2)
+        fout.setframerate(sample_rate)
+        fout.writeframes(pcm.tobytes())
+
+def noisy_filename(split,room,distractor,speaker,chapter,segment,mic,degrees):
+    """
+    Returns the path of a noisy recording, relative to the dataset root
+    """
+    query_name = 'Lab41-SRI-VOiCES-{}-{}-sp{:04d}-ch{:06d}-sg{:04d}-mc{:02d}-stu-clo-dg{:03d}'.format(
+        room,distractor,speaker,chapter,segment,mic,degrees)
+    return 'distant-16k/speech/{}/{}/{}/sp{:04d}/{}.wav'.format(split,room,distractor,speaker,query_name)
+
+def source_filename(split,speaker,chapter,segment):
+    """
+    Returns the path of a source recording, relative to the dataset root
+    """
+    return 'source-16k/{}/sp{:04d}/Lab41-SRI-VOiCES-src-sp{:04d}-ch{:06d}-sg{:04d}.wav'.format(
+        split,speaker,speaker,chapter,segment)
+
+def build_synthetic_dataset(dataset_root,num_speakers=6,segments_per_speaker=3,mics_per_room=3,
+                            min_duration=0.5,max_duration=2.0,sample_rate=16000,seed=0):
+    """
+    Writes a synthetic VOiCES-shaped dataset to disk
+
+    Inputs:
+        dataset_root - The path to the root of the synthetic dataset
+        num_speakers - The number of speakers in each split
+        segments_per_speaker - The number of source segments per speaker
+        mics_per_room - The number of mics in each room
+        min_duration - The minimum recording duration in seconds
+        max_duration - The maximum recording duration in seconds
+        sample_rate - The sampling rate of every recording in hz
+        seed - The random seed
+    Outputs:
+        num_recordings - The number of noisy recordings written
+    """
+    rng = np.random.RandomState(seed)
+    os.makedirs(os.path.join(dataset_root,'references'),exist_ok=True)
+
+    gender_rows = []
+    chapter_rows = []
+    transcript_rows = []
+    time_rows = []
+    speaker = 0
+    for split in ['train','test']:
+        for _ in range(num_speakers):
+            speaker += 1
+            chapter = int(rng.randint(1,999999))
+            gender_rows.append({'Speaker':speaker,'Gender':'MF'[speaker%2],'Dataset':split})
+            chapter_rows.append({'Speaker':speaker,'Book':int(rng.randint(1,9999)),'Chapter':chapter})
+            for segment in range(1,segments_per_speaker+1):
+                source_length = int(rng.uniform(min_duration,max_duration)*sample_rate)
+                src_file = source_filename(split,speaker,chapter,segment)
+                os.makedirs(os.path.join(dataset_root,os.path.dirname(src_file)),exist_ok=True)
+                write_wav(os.path.join(dataset_root,src_file),
+                          0.1*rng.randn(source_length),sample_rate)
+                transcript = ' '.join(rng.choice(WORDS,size=8))
+                for room in ROOMS:
+                    for distractor in DISTRACTORS:
+                        for mic in range(1,mics_per_room+1):
+                            degrees = int(rng.choice([0,30,60,90,120,150,180]))
+                            filename = noisy_filename(split,room,distractor,speaker,
+                                                      chapter,segment,mic,degrees)
+                            # A few recordings are truncated, as some are in the
+                            # real dataset
+                            noisy_length = source_length
+                            if rng.uniform()<0.1:
+                                noisy_length -= int(rng.randint(1,sample_rate//10))
+                            os.makedirs(os.path.join(dataset_root,os.path.dirname(filename)),exist_ok=True)
+                            write_wav(os.path.join(dataset_root,filename),
+                                      0.1*rng.randn(noisy_length),sample_rate)
+                            query_name = os.path.splitext(os.path.basename(filename))[0]
+                            transcript_rows.append({'file_name':query_name,'transcript':transcript})
+                            time_rows.append({'noisy_filename':filename,
+                                              'noisy_length':noisy_length,
+                                              'noisy_sr':sample_rate,
+                                              'noisy_time':noisy_length/sample_rate,
+                                              'source_length':source_length,
+                                              'source_sr':sample_rate,
+                                              'source_time':source_length/sample_rate})
+
+    references = os.path.join(dataset_root,'references')
+    pd.DataFrame(gender_rows).to_csv(os.path.join(references,'Lab41-SRI-VOiCES-speaker-gender-dataset.tbl'),
+                                     sep='\t',index=False)
+    pd.DataFrame(chapter_rows).to_csv(os.path.join(references,'Lab41-SRI-VOiCES-speaker-book-chapter.tbl'),
+                                      sep='\t',index=False)
+    pd.DataFrame(transcript_rows).to_csv(os.path.join(references,'filename_transcripts'),
+                                         index_label='index')
+    pd.DataFrame(time_rows).to_csv(os.path.join(references,'time_values.csv'),
+                                   index_label='index')
+    return len(time_rows)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o',dest='DATASET_ROOT',help='Root of the synthetic dataset',
+                        required=True,type=str)
+    parser.add_argument('-s',dest='NUM_SPEAKERS',help='Speakers per split',
+                        default=6,type=int)
+    parser.add_argument('-g',dest='SEGMENTS',help='Source segments per speaker',
+                        default=3,type=int)
+    parser.add_argument('-m',dest='MICS',help='Mics per room',
+                        default=3,type=int)
+    parser.add_argument('--min_duration',dest='MIN_DURATION',help='Minimum recording duration in seconds',
+                        default=0.5,type=float)
+    parser.add_argument('--max_duration',dest='MAX_DURATION',help='Maximum recording duration in seconds',
+                        default=2.0,type=float)
+    parser.add_argument('--seed',dest='SEED',help='Random seed',
+                        default=0,type=int)
+    args = parser.parse_args()
+
+    num_recordings = build_synthetic_dataset(args.DATASET_ROOT,num_speakers=args.NUM_SPEAKERS,
+                                             segments_per_speaker=args.SEGMENTS,
+                                             mics_per_room=args.MICS,
+                                             min_duration=args.MIN_DURATION,
+                                             max_duration=args.MAX_DURATION,seed=args.SEED)
+    print('Wrote {} recordings to {}'.format(num_recordings,args.DATASET_ROOT))
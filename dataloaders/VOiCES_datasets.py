@@ -4,6 +4,9 @@ import torch
 from torch.utils.data import Dataset
 from torch.nn.utils.rnn import pad_sequence
 import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
 import librosa
 
 class PadSequence:
@@ -39,6 +42,174 @@ class PadSequence:
         labels = torch.LongTensor(list(map(lambda x: x[1], sorted_batch)))
         return sequences_padded, lengths, labels
 
+class AudioCache:
+    """
+    A bounded least-recently-used cache of decoded waveforms, keyed by any
+    hashable key, e.g. the source_id column of a VOiCES index.
+
+    The cache is safe to use from several threads.  When several threads miss
+    on the same key at once, only the first reads the file, and the others
+    wait for its result.  Pickling drops the cached waveforms, so a cache
+    passed to DataLoader worker processes starts out empty in each worker,
+    whatever the multiprocessing start method.
+
+    # Arguments:
+        resolve_path: Callable returning the path of the audio file for a key.
+            Must be picklable to be used by DataLoader worker processes.
+        max_bytes: The maximum total size of the cached waveforms, in bytes
+        samplerate: The sampling rate to load the waveforms at
+    """
+    def __init__(self,resolve_path,max_bytes=512*1024**2,samplerate=16000):
+        self.resolve_path = resolve_path
+        self.max_bytes = max_bytes
+        self.samplerate = samplerate
+        self._reset()
+
+    def _reset(self):
+        self.cache = OrderedDict()
+        self.in_flight = {}
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __getitem__(self,key):
+        """
+        Returns the waveform for a key as a 1d float array.  The array is
+        shared with the cache and must not be modified in place.  misses
+        counts the files read, and hits every other lookup.
+        """
+        with self.lock:
+            waveform = self.cache.get(key)
+            if waveform is not None:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return waveform
+            future = self.in_flight.get(key)
+            reader = future is None
+            if reader:
+                future = Future()
+                self.in_flight[key] = future
+                self.misses += 1
+            else:
+                self.hits += 1
+        if not reader:
+            # Another thread is already reading this file
+            return future.result()
+        try:
+            waveform,_ = librosa.load(self.resolve_path(key),sr=self.samplerate)
+            waveform.flags.writeable = False
+        except BaseException as e:
+            with self.lock:
+                del self.in_flight[key]
+            future.set_exception(e)
+            raise
+        with self.lock:
+            del self.in_flight[key]
+            self.cache[key] = waveform
+            self.num_bytes += waveform.nbytes
+            # Evict the least recently used waveforms, always keeping the newest
+            while self.num_bytes>self.max_bytes and len(self.cache)>1:
+                _,evicted = self.cache.popitem(last=False)
+                self.num_bytes -= evicted.nbytes
+        future.set_result(waveform)
+        return waveform
+
+    def __len__(self):
+        return len(self.cache)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        for name in ['cache','in_flight','num_bytes','hits','misses','lock']:
+            del state[name]
+        return state
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        self._reset()
+
+class _SourcePaths:
+    """
+    Maps each source_id of a sources file to the path of its source recording
+    """
+    def __init__(self,dataset_root,sources_df):
+        self.dataset_root = dataset_root
+        self.source_paths = dict(zip(sources_df['source_id'],sources_df['source']))
+
+    def __call__(self,source_id):
+        return os.path.join(self.dataset_root,self.source_paths[source_id])
+
+class SourceAudioCache(AudioCache):
+    """
+    An AudioCache of decoded source (clean) waveforms, keyed by the source_id
+    column of a VOiCES index.
+
+    Every source recording is played back in many rooms, on many mics and with
+    many distractors, so a few thousand sources are shared by hundreds of
+    thousands of noisy recordings.  One cache can be shared by every dataset
+    and consumer in a process that uses the same sources, so each source is
+    only read and decoded once while it stays in the cache.  A cache covers the
+    sources in sources_df only.  Source IDs written by build_indices.py are
+    unique across the train and test splits, so to share a cache between both
+    splits pass the two sources files concatenated.
+
+    # Arguments:
+        dataset_root: The path to the root of the VOiCES dataset
+        sources_df: A dataframe with source_id and source columns, such as a
+            sources file written by build_indices.py (train_sources.csv or
+            test_sources.csv)
+        max_bytes: The maximum total size of the cached waveforms, in bytes
+        samplerate: The sampling rate to load the waveforms at
+    """
+    def __init__(self,dataset_root,sources_df,max_bytes=512*1024**2,samplerate=16000):
+        super().__init__(_SourcePaths(dataset_root,sources_df),max_bytes=max_bytes,
+                         samplerate=samplerate)
+
+class ConcurrentAudioLoader:
+    """
+    Loads a batch of audio files with the reads issued concurrently from a
+    thread pool, rather than one after another.  On network mounted dataset
+    roots, where every open and read is a high latency round trip, a batch then
+    costs about as long as its slowest file rather than the sum of all of them.
+
+    The thread pool is created on first use in each process.  It is not
+    pickled, and a pool inherited through fork, whose threads do not exist in
+    the child, is replaced, so a loader can be passed to a dataset used by
+    DataLoader worker processes and each worker gets its own pool, even if the
+    loader was already used in the parent.
+
+    # Arguments:
+        max_in_flight: The maximum number of files being read at once
+        samplerate: The sampling rate to load the waveforms at
+        load_fn: Callable with the signature of librosa.load, used to read each
+            file.  Can be replaced, e.g. to inject latency when testing.
+    """
+    def __init__(self,max_in_flight=16,samplerate=16000,load_fn=librosa.load):
+        self.max_in_flight = max_in_flight
+        self.samplerate = samplerate
+        self.load_fn = load_fn
+        self.executor = None
+        self.executor_pid = None
+
+    def _load(self,filepath):
+        waveform,_ = self.load_fn(filepath,sr=self.samplerate)
+        return waveform
+
+    def load_many(self,filepaths):
+        """
+        Returns the waveforms of a list of files, in the same order as filepaths
+        """
+        if self.executor is None or self.executor_pid!=os.getpid():
+            self.executor = ThreadPoolExecutor(max_workers=self.max_in_flight)
+            self.executor_pid = os.getpid()
+        return list(self.executor.map(self._load,filepaths))
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['executor'] = None
+        state['executor_pid'] = None
+        return state
+
 class VOiCES_SpeakerVerification(Dataset):
     """
     A torch dataset class for speaker/gender classification tasks.
@@ -53,8 +224,13 @@ class VOiCES_SpeakerVerification(Dataset):
         label:  One of {speaker, sex}. Whether to use sex or speaker ID as a label
         transform:  Callable, transformation to perform on the waveform.  Must return array
             with shape (time,channels)
+        source_cache:  Optional SourceAudioCache used by get_source.  Requires df to have
+            the source_id column written by build_indices.py
+        loader:  Optional ConcurrentAudioLoader.  If set, __getitems__ reads the files of a
+            batch concurrently
     """
-    def __init__(self,dataset_root,df,min_length=0.0,max_length=30.0,label='speaker',transform=None):
+    def __init__(self,dataset_root,df,min_length=0.0,max_length=30.0,label='speaker',transform=None,
+                 source_cache=None,loader=None):
         if label not in ('sex','speaker'):
             raise(ValueError, 'Label type must be one of (\'sex\', \'speaker\')')
         self.default_samplerate=16000
@@ -74,12 +250,31 @@ class VOiCES_SpeakerVerification(Dataset):
         
         
         self.transform = transform
+        self.source_cache = source_cache
+        self.loader = loader
         
     def __getitem__(self,index):
         item = self.df.iloc[index]
         filepath = os.path.join(self.dataset_root,item['filename'])
         instance,samplerate = librosa.load(filepath,sr=self.default_samplerate)
-        
+        return self._make_item(item,instance)
+
+    def __getitems__(self,indices):
+        """
+        Returns the items for a batch of indices, as a list.  Used by DataLoader in place of
+        __getitem__ when batching, so that with a loader the whole batch is read at once.
+        """
+        if self.loader is None:
+            return [self[index] for index in indices]
+        items = self.df.iloc[indices]
+        filepaths = [os.path.join(self.dataset_root,filename) for filename in items['filename']]
+        instances = self.loader.load_many(filepaths)
+        return [self._make_item(items.iloc[i],instance) for i,instance in enumerate(instances)]
+
+    def _make_item(self,item,instance):
+        """
+        Converts a loaded waveform and its index entry to a (waveform, label) pair
+        """
         if self.label == 'sex':
             gender = item['gender']
             if gender == 'M':
@@ -95,6 +290,21 @@ class VOiCES_SpeakerVerification(Dataset):
         instance = torch.from_numpy(instance)
         return instance,label
     
+    def get_source(self,index):
+        """
+        Returns the source (clean) waveform of an item, with shape (time,channels), for
+        comparing against the noisy recording returned by __getitem__.  The transform is not
+        applied.
+        """
+        item = self.df.iloc[index]
+        if self.source_cache is not None:
+            instance = self.source_cache[item['source_id']]
+        else:
+            filepath = os.path.join(self.dataset_root,item['source'])
+            instance,samplerate = librosa.load(filepath,sr=self.default_samplerate)
+        instance = instance[:,np.newaxis]
+        return torch.tensor(instance)
+
     def __len__(self):
         return len(self.df)
 
@@ -0,0 +1,216 @@
+import numpy as np
+import torch.distributed as dist
+from torch.utils.data import Sampler
+
+def balanced_partition(chunks,weights,num_bins):
+    """
+    Assigns items to bins so that every bin ends up with about the same total
+    weight and the same number of items.
+
+    Items arrive in chunks of at most num_bins items, and the items of a chunk
+    always go to distinct bins, so a chunk made of items from one class spreads
+    that class over the bins.  Chunks are placed heaviest first, and within a
+    chunk the heaviest item goes to the lightest bin.  Chunks with fewer than
+    num_bins items go to the bins with the fewest items, so that bin sizes
+    never differ by more than one.
+
+    Arguments:
+        chunks: List of integer arrays of item indices, each with at most
+            num_bins entries
+        weights: Array of item weights, indexed by item
+        num_bins: The number of bins
+    Returns:
+        bins: List of num_bins lists of item indices
+        loads: Array with the total weight of each bin
+    """
+    bins = [[] for _ in range(num_bins)]
+    loads = np.zeros(num_bins)
+    counts = np.zeros(num_bins,dtype=np.int64)
+    chunk_weights = np.array([weights[chunk].sum() for chunk in chunks])
+    for c in np.argsort(-chunk_weights,kind='mergesort'):
+        chunk = chunks[c]
+        items = chunk[np.argsort(-weights[chunk],kind='mergesort')]
+        if len(items)==num_bins:
+            targets = np.argsort(loads,kind='mergesort')
+        else:
+            targets = np.lexsort((loads,counts))[:len(items)]
+        for item,target in zip(items,targets):
+            bins[target].append(item)
+        loads[targets] += weights[items]
+        counts[targets] += 1
+    return bins,loads
+
+def _imbalance(loads):
+    """
+    Returns how much longer the heaviest bin is than the average, as a fraction
+    """
+    mean = np.mean(loads)
+    return float(np.max(loads)/mean-1.0) if mean>0 else 0.0
+
+class DurationBalancedSampler(Sampler):
+    """
+    A sampler for distributed training on VOiCES_SpeakerVerification that
+    partitions the dataset across ranks by cumulative noisy_time, rather than
+    by number of recordings, so that every rank has about the same amount of
+    audio to process per epoch.
+
+    The partition is speaker-stratified: each speaker's recordings are split
+    into groups of num_replicas that are spread over all the ranks, so every
+    rank sees every speaker with at least num_replicas recordings.  Every rank
+    gets the same number of samples, so all ranks take the same number of
+    steps.  The partition depends only on the seed and epoch, so all ranks
+    compute the same partition without communicating.  Call set_epoch at the
+    start of every epoch, as with DistributedSampler.
+
+    If num_workers is more than one, each rank's samples are further split
+    into batch_size batches that are balanced by duration over the DataLoader
+    workers, and ordered so that the DataLoader's round-robin dispatch sends
+    each worker its own share.  num_workers and batch_size must then match
+    the DataLoader's.
+
+    # Arguments:
+        dataset: A VOiCES_SpeakerVerification dataset
+        num_replicas: The number of ranks.  Defaults to the world size of the
+            default process group, or 1 if torch.distributed is not initialized
+        rank: The rank of this process.  Defaults to the rank in the default
+            process group, or 0
+        shuffle: If true, the grouping and order of samples change every epoch
+        seed: The random seed, must be the same on every rank
+        drop_last: If true, ranks with an extra sample drop their shortest
+            recording.  Otherwise, ranks with one sample fewer repeat the
+            shortest recording in the dataset.
+        num_workers: The number of DataLoader workers to balance across
+        batch_size: The DataLoader batch size, only used if num_workers > 1
+    """
+    def __init__(self,dataset,num_replicas=None,rank=None,shuffle=True,seed=0,
+                 drop_last=False,num_workers=0,batch_size=1):
+        if num_replicas is None:
+            num_replicas = dist.get_world_size() if dist.is_available() and dist.is_initialized() else 1
+        if rank is None:
+            rank = dist.get_rank() if dist.is_available() and dist.is_initialized() else 0
+        if rank>=num_replicas or rank<0:
+            raise ValueError('Invalid rank {}, rank should be in the interval [0, {}]'.format(rank,num_replicas-1))
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.shuffle = shuffle
+        self.seed = seed
+        self.drop_last = drop_last
+        self.num_workers = num_workers
+        self.batch_size = batch_size
+        self.epoch = 0
+
+        self.durations = dataset.df['noisy_time'].values.astype(np.float64)
+        speakers = dataset.df['speaker'].values
+        # Positions of each speaker's recordings, in dataset order
+        order = np.argsort(speakers,kind='mergesort')
+        boundaries = np.flatnonzero(speakers[order][1:]!=speakers[order][:-1])+1
+        self.speaker_positions = np.split(order,boundaries)
+
+        total = len(self.durations)
+        if self.drop_last:
+            self.num_samples = total//self.num_replicas
+        else:
+            self.num_samples = -(-total//self.num_replicas)
+        self._cache = None
+
+    def set_epoch(self,epoch):
+        self.epoch = epoch
+
+    def _partition(self):
+        """
+        Computes the partition for the current epoch, returning the ordered
+        samples of this rank and the partition statistics
+        """
+        if self._cache is not None and self._cache[0]==self.epoch:
+            return self._cache[1],self._cache[2]
+        rng = np.random.RandomState([self.seed,self.epoch])
+
+        # Split every speaker into groups of num_replicas recordings
+        chunks = []
+        for positions in self.speaker_positions:
+            if self.shuffle:
+                positions = rng.permutation(positions)
+            for start in range(0,len(positions),self.num_replicas):
+                chunks.append(positions[start:start+self.num_replicas])
+        rank_bins,rank_loads = balanced_partition(chunks,self.durations,self.num_replicas)
+        rank_items = [len(b) for b in rank_bins]
+
+        samples = np.array(rank_bins[self.rank],dtype=np.int64)
+        if len(samples)>self.num_samples:
+            by_length = samples[np.argsort(self.durations[samples],kind='mergesort')]
+            samples = by_length[len(samples)-self.num_samples:]
+        elif len(samples)<self.num_samples:
+            # Pad from the whole dataset, since with fewer recordings than
+            # ranks this rank's own share may be empty
+            by_length = np.argsort(self.durations,kind='mergesort')
+            samples = np.concatenate([samples,by_length[:self.num_samples-len(samples)]])
+        if self.shuffle:
+            samples = rng.permutation(samples)
+        else:
+            samples = np.sort(samples)
+
+        stats = {'epoch':self.epoch,
+                 'rank_seconds':rank_loads.tolist(),
+                 'rank_items':rank_items,
+                 'rank_imbalance':_imbalance(rank_loads)}
+        if self.num_workers>1:
+            samples,worker_loads = self._balance_workers(samples,rng)
+            stats['worker_seconds'] = worker_loads.tolist()
+            stats['worker_imbalance'] = _imbalance(worker_loads)
+        self._cache = (self.epoch,samples,stats)
+        return samples,stats
+
+    def _balance_workers(self,samples,rng):
+        """
+        Reorders this rank's samples so that the DataLoader's workers receive
+        batches with about the same total duration
+        """
+        num_full = len(samples)//self.batch_size
+        batches = samples[:num_full*self.batch_size].reshape(num_full,self.batch_size)
+        remainder = samples[num_full*self.batch_size:]
+        batch_seconds = self.durations[batches].sum(axis=1) if num_full else np.zeros(0)
+        batch_ids = np.arange(num_full)
+        chunks = [batch_ids[start:start+self.num_workers] for start in range(0,num_full,self.num_workers)]
+        worker_bins,_ = balanced_partition(chunks,batch_seconds,self.num_workers)
+        # Batch i of the epoch is dispatched to worker i % num_workers, so
+        # interleave the workers' batches.  Bin sizes differ by at most one,
+        # and the bins with an extra batch must be the first workers for the
+        # last, partial round to line up.  The short batch, if any, goes last
+        # so that the DataLoader batches line up with ours.
+        worker_bins = sorted(worker_bins,key=len,reverse=True)
+        ordered = []
+        for round_ in range(len(worker_bins[0])):
+            for worker in range(self.num_workers):
+                if round_<len(worker_bins[worker]):
+                    ordered.append(batches[worker_bins[worker][round_]])
+        if len(remainder):
+            ordered.append(remainder)
+        # Report the loads each worker will actually receive
+        worker_loads = np.zeros(self.num_workers)
+        for i,batch in enumerate(ordered):
+            worker_loads[i%self.num_workers] += self.durations[batch].sum()
+        if not ordered:
+            return samples,worker_loads
+        return np.concatenate(ordered),worker_loads
+
+    def load_imbalance(self):
+        """
+        Returns a dictionary of statistics about the current epoch's partition:
+
+            epoch: The epoch
+            rank_seconds: Seconds of audio assigned to each rank
+            rank_items: Number of recordings assigned to each rank, before
+                padding or dropping to num_samples
+            rank_imbalance: How much longer the slowest rank's share is than
+                the average, as a fraction
+            worker_seconds, worker_imbalance: The same for this rank's
+                DataLoader workers, if num_workers > 1
+        """
+        return self._partition()[1]
+
+    def __iter__(self):
+        samples,_ = self._partition()
+        return iter(samples.tolist())
+
+    def __len__(self):
+        return self.num_samples
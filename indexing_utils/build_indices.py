@@ -1,6 +1,7 @@
 """
 This script will produce two csv files that can serves as index files for the
-training and test splits of the VOiCES data.
+training and test splits of the VOiCES data, and two csv files that index the
+source audio used by each split.
 
 The script takes in two command line arguments.
 
@@ -9,13 +10,13 @@ The script takes in two command line arguments.
 -i: The path to place the output csv files.  Defaults to /references subfolder
 of the dataset root.
 
-There are two output csv files, both with the same column structure (explained
+There are two output index files, both with the same column structure (explained
 below):
 
 train_index.csv : A csv file with a row for every entry in the train split
 test_index.csv : A csv file with a row for every entry in the test splits
 
-Both outputs have the following set of columns:
+Both index files have the following set of columns:
 
 index: The entry index (int)
 chapter: The librispeech chapter ID for the transcript (int)
@@ -39,11 +40,31 @@ noisy_time:  The length of the recording in seconds (float)
 source_length: The length of the source audio in samples (int)
 source_sr: The sampling rate of the source audio in Hz, should be 16000 (int)
 source_time: The length of the source audio in seconds (float)
+source_id: The ID of the source audio in the matching sources file, unique
+    across the train and test splits (int)
+
+There are also two output sources files, with a row for every unique source
+recording used by the split:
+
+train_sources.csv : The source audio of the train split
+test_sources.csv : The source audio of the test split
+
+Both sources files have the following set of columns:
+
+source_id: The source ID, referenced by the source_id column of the index.
+    Test IDs follow on from the train IDs, so no ID is used by both (int)
+source: The filepath for the source audio, relative to the dataset root (string)
+speaker:  The librispeech speaker ID (int)
+transcript:  The orthographic transcript of the source audio (string)
+source_length: The length of the source audio in samples (int)
+source_sr: The sampling rate of the source audio in Hz, should be 16000 (int)
+source_time: The length of the source audio in seconds (float)
 
 """
 
 import os
 import argparse
+import numpy as np
 import pandas as pd
 
 def parse_file(filename):
@@ -105,6 +126,33 @@ def get_source_file(noisy_spch):
     speaker = noisy_spch[noisy_spch.find('-sp')+1:noisy_spch.find('-ch')]
     src_file = 'source-16k/'+train_test+'/'+speaker+'/'+'Lab41-SRI-VOiCES-src'+noisy_spch[noisy_spch.find('-sp'):noisy_spch.find('-mc')]+'.wav'
     return src_file
+def get_source_files(noisy_files):
+    """
+    Retrieves the original source file for every entry of a pandas Series of
+    noisy filenames, with the same result as calling get_source_file on each
+    entry
+    """
+    is_train = noisy_files.str.contains('train',regex=False).values
+    is_test = noisy_files.str.contains('test',regex=False).values
+    if not (is_train | is_test).all():
+        raise ValueError('File was not in train or test directory')
+    train_test = np.where(is_train,'train','test')
+    # The first group runs from '-sp' to '-mc' and the second is the speaker
+    parts = noisy_files.str.extract(r'(-(sp[^-/]*)-ch[^/]*?)-mc')
+    src_files = ('source-16k/'+train_test+'/'+parts[1]+'/'+'Lab41-SRI-VOiCES-src'
+                 +parts[0]+'.wav')
+    return src_files
+def build_source_table(index_df,first_id=0):
+    """
+    Builds a table with one row per unique source file in an index, and adds a
+    source_id column to the index referencing its rows.  IDs are numbered from
+    first_id, so that the tables of several splits can share one ID space.
+    """
+    codes,_ = pd.factorize(index_df['source'],sort=True)
+    index_df = index_df.assign(source_id=codes+first_id)
+    source_columns = ['source','speaker','transcript','source_length','source_sr','source_time']
+    sources_df = index_df.groupby('source_id',sort=True)[source_columns].first()
+    return index_df,sources_df.reset_index()
 def full_pipeline(filename,speaker_gender_df):
     file_info = parse_file(filename)
     file_info = add_gender(file_info,speaker_gender_df)
@@ -150,16 +198,18 @@ if __name__ == '__main__':
     train_info = []
     for name in train_file_list:
         info_dict = full_pipeline(name,speaker_gender_df)
-        source_filename = get_source_file(name)
-        info_dict['source']=source_filename
         train_info.append(info_dict)
     train_index = pd.DataFrame(train_info)
+    train_index['source'] = get_source_files(train_index['filename'])
     # Add transcripts to index
     train_index = train_index.join(full_ref_df.set_index('file_name'),on='query_name')
     # Add precomputed information on the lengths of the files
     train_index = train_index.join(time_df2.set_index('filename'),on='filename')
+    # Deduplicate the source files into their own table
+    train_index,train_sources = build_source_table(train_index)
     # Save
     train_index.to_csv(path_or_buf = INDEX_PATH+'train_index.csv',index_label='index')
+    train_sources.to_csv(path_or_buf = INDEX_PATH+'train_sources.csv',index=False)
 
     #Find all files in test set
     print('Scraping Testing Files')
@@ -172,13 +222,17 @@ if __name__ == '__main__':
     test_info = []
     for name in test_file_list:
         info_dict = full_pipeline(name,speaker_gender_df)
-        source_filename = get_source_file(name)
-        info_dict['source']=source_filename
         test_info.append(info_dict)
     test_index = pd.DataFrame(test_info)
+    test_index['source'] = get_source_files(test_index['filename'])
     # Add transcripts to index
     test_index = test_index.join(full_ref_df.set_index('file_name'),on='query_name')
     # Add precomputed information on the lengths of the files
     test_index = test_index.join(time_df2.set_index('filename'),on='filename')
+    # Deduplicate the source files into their own table
+    # Number the test sources after the train sources, so IDs are unique
+    # across both splits
+    test_index,test_sources = build_source_table(test_index,first_id=len(train_sources))
     # Save
     test_index.to_csv(path_or_buf = INDEX_PATH+'test_index.csv',index_label='index')
+    test_sources.to_csv(path_or_buf = INDEX_PATH+'test_sources.csv',index=False)
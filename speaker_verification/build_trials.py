@@ -0,0 +1,308 @@
+"""
+This script builds a speaker verification trial list from a VOiCES index file.
+
+Each trial pairs an enrollment recording with a test recording, and is either a
+target trial (both recordings share a speaker) or a non-target trial (the
+speakers differ).  The enrollment and test sides are drawn from independently
+filtered slices of the index, so trials can be built for any combination of
+room, mic and distractor conditions, e.g. enroll on close-talking mics with no
+distractor and test on far-field mics with babble noise.  When a recording is
+in both slices, each unordered pair of such recordings is kept at most once,
+since scores are symmetric and the pair would otherwise be counted twice.
+
+The script takes in the following command line arguments:
+
+-i: The absolute path to the VOiCES index file (.csv) to draw trials from
+-o: The absolute path for the output trial list (.csv)
+--enroll_rooms, --enroll_mics, --enroll_distractors: Optional.  Restrict the
+    enrollment side to these rooms, mics and distractor types
+--test_rooms, --test_mics, --test_distractors: Optional.  Restrict the test
+    side to these rooms, mics and distractor types
+--max_targets:  Optional.  Randomly subsample the target trials down to this
+    many trials
+--nontarget_ratio:  The number of non-target trials to draw per target trial,
+    defaults to 1.0
+--allow_same_source:  Optional.  If enabled, target trials whose enrollment
+    and test recordings were played from the same Librispeech source audio are
+    kept.  By default they are dropped, as they only differ by channel.
+--seed: The random seed used for sampling trials, defaults to 0
+
+The output is a csv file with a row for each trial and the following columns
+
+enroll: The query_name of the enrollment recording (string)
+test: The query_name of the test recording (string)
+target: 1 for a target trial and 0 for a non-target trial (int)
+"""
+
+import argparse
+import numpy as np
+import pandas as pd
+
+def filter_index(df,rooms=None,mics=None,distractors=None):
+    """
+    Restricts a VOiCES index dataframe to a set of recording conditions
+
+    Inputs:
+        df - A pandas dataframe representing the index file of the dataset,
+            with the default columns of VOiCES index files.
+        rooms - Iterable of room values to keep (e.g. ['rm1','rm2']), or None
+            to keep all rooms
+        mics - Iterable of mic values to keep, or None to keep all mics
+        distractors - Iterable of distractor values to keep, or None to keep
+            all distractor types
+    Outputs:
+        new_df - The filtered dataframe
+    """
+    mask = np.ones(len(df),dtype=bool)
+    if rooms is not None:
+        mask &= df['room'].isin(list(rooms)).values
+    if mics is not None:
+        mask &= df['mic'].isin([int(m) for m in mics]).values
+    if distractors is not None:
+        mask &= df['distractor'].isin(list(distractors)).values
+    return df[mask]
+
+# Pairs are enumerated and drawn this many at a time, bounding peak memory
+PAIR_CHUNK_SIZE = 10000000
+# Pairs are enumerated rather than drawn when there are at most this many
+# times as many candidates as trials requested
+ENUMERATE_FACTOR = 4
+
+def _enumerate_pairs(num_pairs,keep_fn):
+    """
+    Returns every integer pair ID in [0, num_pairs) for which keep_fn is true,
+    evaluating keep_fn on chunks of IDs
+    """
+    kept = []
+    for start in range(0,num_pairs,PAIR_CHUNK_SIZE):
+        pair_ids = np.arange(start,min(start+PAIR_CHUNK_SIZE,num_pairs),dtype=np.int64)
+        kept.append(pair_ids[keep_fn(pair_ids)])
+    return np.concatenate(kept) if kept else np.empty(0,dtype=np.int64)
+
+def _sample_pairs(num_pairs,num_trials,keep_fn,rng):
+    """
+    Draws up to num_trials distinct integer pair IDs in [0, num_pairs) for
+    which keep_fn is true, uniformly at random and in vectorized rounds.
+    Stops early if a round finds no new pairs, which only happens when nearly
+    every valid pair has already been drawn.
+    """
+    pair_ids = np.empty(0,dtype=np.int64)
+    while len(pair_ids)<num_trials:
+        num_draws = min(max(2*(num_trials-len(pair_ids)),1024),PAIR_CHUNK_SIZE)
+        new_ids = rng.randint(0,num_pairs,num_draws,dtype=np.int64)
+        new_ids = new_ids[keep_fn(new_ids)]
+        num_before = len(pair_ids)
+        pair_ids = np.unique(np.concatenate([pair_ids,new_ids]))
+        if len(pair_ids)==num_before:
+            break
+    if len(pair_ids)>num_trials:
+        pair_ids = np.sort(rng.choice(pair_ids,num_trials,replace=False))
+    return pair_ids
+
+def _in_both_slices(enroll_names,test_names):
+    """
+    Returns boolean arrays marking the enrollment recordings that are also on
+    the test side, and the test recordings that are also on the enrollment
+    side
+    """
+    e_shared = pd.Series(enroll_names).isin(test_names).values
+    t_shared = pd.Series(test_names).isin(enroll_names).values
+    return e_shared,t_shared
+
+def build_target_trials(enroll_df,test_df,max_targets=None,allow_same_source=False,seed=0):
+    """
+    Builds the target trials between the enrollment and test dataframes
+
+    Every same-speaker pair is given an integer ID, speaker by speaker, so that
+    pairs can be counted from the number of recordings per speaker and drawn
+    without building the full list of pairs.  The full list is only built when
+    it is at most a few times longer than max_targets.  Pairs of recordings
+    that are on both sides are kept in one order only.
+
+    Inputs:
+        enroll_df - VOiCES index dataframe for the enrollment side
+        test_df - VOiCES index dataframe for the test side
+        max_targets - If not None, randomly subsample down to this many trials.
+            Should be set for large indices, as otherwise every pair is kept.
+        allow_same_source - If False, drop pairs that share a source recording
+        seed - Random seed for subsampling
+    Outputs:
+        trials - A dataframe with columns enroll, test and target
+    """
+    enroll_speakers = enroll_df['speaker'].values
+    test_speakers = test_df['speaker'].values
+    enroll_order = np.argsort(enroll_speakers,kind='mergesort')
+    test_order = np.argsort(test_speakers,kind='mergesort')
+    sorted_test_speakers = test_speakers[test_order]
+
+    # Where each speaker's recordings start in the sorted enrollment and test
+    # sides, and how many pairs each speaker contributes
+    speakers,e_start,e_count = np.unique(enroll_speakers[enroll_order],return_index=True,
+                                         return_counts=True)
+    t_start = np.searchsorted(sorted_test_speakers,speakers,side='left')
+    t_count = np.searchsorted(sorted_test_speakers,speakers,side='right')-t_start
+    offsets = np.concatenate([[0],np.cumsum(e_count.astype(np.int64)*t_count)])
+    num_pairs = int(offsets[-1])
+
+    enroll_names = enroll_df['query_name'].values
+    test_names = test_df['query_name'].values
+    enroll_sources = enroll_df['source'].values
+    test_sources = test_df['source'].values
+    e_shared,t_shared = _in_both_slices(enroll_names,test_names)
+
+    def decode(pair_ids):
+        speaker = np.searchsorted(offsets,pair_ids,side='right')-1
+        e_ind,t_ind = np.divmod(pair_ids-offsets[speaker],t_count[speaker])
+        return enroll_order[e_start[speaker]+e_ind],test_order[t_start[speaker]+t_ind]
+
+    def keep_fn(pair_ids):
+        e_ind,t_ind = decode(pair_ids)
+        keep = enroll_names[e_ind]!=test_names[t_ind]
+        if not allow_same_source:
+            keep &= enroll_sources[e_ind]!=test_sources[t_ind]
+        # (a,b) and (b,a) are the same trial when both are on both sides
+        keep &= ~(e_shared[e_ind]&t_shared[t_ind])|(enroll_names[e_ind]<test_names[t_ind])
+        return keep
+
+    rng = np.random.RandomState(seed)
+    if max_targets is None or num_pairs<=ENUMERATE_FACTOR*max_targets:
+        pair_ids = _enumerate_pairs(num_pairs,keep_fn)
+        if max_targets is not None and len(pair_ids)>max_targets:
+            pair_ids = np.sort(rng.choice(pair_ids,max_targets,replace=False))
+    else:
+        pair_ids = _sample_pairs(num_pairs,max_targets,keep_fn,rng)
+    e_ind,t_ind = decode(pair_ids)
+    trials = pd.DataFrame({'enroll':enroll_names[e_ind],
+                           'test':test_names[t_ind],
+                           'target':1})
+    return trials
+
+def build_nontarget_trials(enroll_df,test_df,num_trials,seed=0):
+    """
+    Draws distinct non-target trials uniformly at random, without replacement
+
+    Candidate pairs are drawn in vectorized rounds and encoded as a single
+    integer, so that duplicates can be removed with one np.unique call per
+    round rather than a Python loop over trials.  As for target trials, pairs
+    of recordings that are on both sides are kept in one order only.
+
+    Inputs:
+        enroll_df - VOiCES index dataframe for the enrollment side
+        test_df - VOiCES index dataframe for the test side
+        num_trials - The number of non-target trials to draw.  If this is more
+            than the number of possible non-target pairs, every pair is kept.
+        seed - Random seed for sampling
+    Outputs:
+        trials - A dataframe with columns enroll, test and target
+    """
+    enroll_speakers = enroll_df['speaker'].values
+    test_speakers = test_df['speaker'].values
+    enroll_names = enroll_df['query_name'].values
+    test_names = test_df['query_name'].values
+    n_enroll = len(enroll_speakers)
+    n_test = len(test_speakers)
+    e_shared,t_shared = _in_both_slices(enroll_names,test_names)
+
+    # Count the possible non-target pairs without enumerating them.  Pairs of
+    # recordings on both sides are counted in both orders, so remove one
+    enroll_counts = pd.Series(enroll_speakers).value_counts()
+    test_counts = pd.Series(test_speakers).value_counts()
+    same_speaker = (enroll_counts*test_counts.reindex(enroll_counts.index,fill_value=0)).sum()
+    shared_counts = pd.Series(enroll_speakers[e_shared]).value_counts()
+    num_shared = int(e_shared.sum())
+    shared_pairs = (num_shared*num_shared-int((shared_counts**2).sum()))//2
+    num_possible = n_enroll*n_test-int(same_speaker)-shared_pairs
+    num_trials = int(min(num_trials,num_possible))
+
+    def keep_fn(pair_ids):
+        e_ind,t_ind = np.divmod(pair_ids,n_test)
+        keep = enroll_speakers[e_ind]!=test_speakers[t_ind]
+        keep &= ~(e_shared[e_ind]&t_shared[t_ind])|(enroll_names[e_ind]<test_names[t_ind])
+        return keep
+
+    rng = np.random.RandomState(seed)
+    if n_enroll*n_test<=ENUMERATE_FACTOR*num_trials:
+        pair_ids = _enumerate_pairs(n_enroll*n_test,keep_fn)
+        if len(pair_ids)>num_trials:
+            pair_ids = np.sort(rng.choice(pair_ids,num_trials,replace=False))
+    else:
+        pair_ids = _sample_pairs(n_enroll*n_test,num_trials,keep_fn,rng)
+    e_ind,t_ind = np.divmod(pair_ids,n_test)
+    trials = pd.DataFrame({'enroll':enroll_names[e_ind],
+                           'test':test_names[t_ind],
+                           'target':0})
+    return trials
+
+def build_trials(df,enroll_conditions=None,test_conditions=None,max_targets=None,
+                 nontarget_ratio=1.0,allow_same_source=False,seed=0):
+    """
+    Builds a speaker verification trial list from a VOiCES index dataframe
+
+    Inputs:
+        df - A pandas dataframe representing the index file of the dataset,
+            with the default columns of VOiCES index files.
+        enroll_conditions - Dictionary of keyword arguments for filter_index
+            selecting the enrollment recordings, e.g. {'mics':[1,2]}
+        test_conditions - Dictionary of keyword arguments for filter_index
+            selecting the test recordings
+        max_targets - If not None, the maximum number of target trials
+        nontarget_ratio - The number of non-target trials per target trial
+        allow_same_source - If False, target trials that share a source
+            recording are dropped
+        seed - Random seed for sampling trials
+    Outputs:
+        trials - A dataframe with a row per trial and columns enroll, test and
+            target
+    """
+    enroll_df = filter_index(df,**(enroll_conditions or {}))
+    test_df = filter_index(df,**(test_conditions or {}))
+    if len(enroll_df)==0 or len(test_df)==0:
+        raise ValueError('No recordings match the enrollment or test conditions')
+    target_trials = build_target_trials(enroll_df,test_df,max_targets=max_targets,
+                                        allow_same_source=allow_same_source,seed=seed)
+    num_nontargets = int(round(nontarget_ratio*len(target_trials)))
+    nontarget_trials = build_nontarget_trials(enroll_df,test_df,num_nontargets,seed=seed)
+    trials = pd.concat([target_trials,nontarget_trials],ignore_index=True)
+    return trials
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i',dest='INDEX_PATH',help='The absolute path to the index file',
+                        required=True,type=str)
+    parser.add_argument('-o',dest='TRIALS_PATH',help='Target file for the trial list',
+                        required=True,type=str)
+    parser.add_argument('--enroll_rooms',dest='ENROLL_ROOMS',nargs='+',default=None,
+                        help='Rooms to draw enrollment recordings from')
+    parser.add_argument('--enroll_mics',dest='ENROLL_MICS',nargs='+',type=int,default=None,
+                        help='Mics to draw enrollment recordings from')
+    parser.add_argument('--enroll_distractors',dest='ENROLL_DISTRACTORS',nargs='+',default=None,
+                        help='Distractor types to draw enrollment recordings from')
+    parser.add_argument('--test_rooms',dest='TEST_ROOMS',nargs='+',default=None,
+                        help='Rooms to draw test recordings from')
+    parser.add_argument('--test_mics',dest='TEST_MICS',nargs='+',type=int,default=None,
+                        help='Mics to draw test recordings from')
+    parser.add_argument('--test_distractors',dest='TEST_DISTRACTORS',nargs='+',default=None,
+                        help='Distractor types to draw test recordings from')
+    parser.add_argument('--max_targets',dest='MAX_TARGETS',default=None,type=int,
+                        help='Maximum number of target trials')
+    parser.add_argument('--nontarget_ratio',dest='NONTARGET_RATIO',default=1.0,type=float,
+                        help='Number of non-target trials per target trial')
+    parser.add_argument('--allow_same_source',dest='ALLOW_SAME_SOURCE',action='store_true',
+                        help='Keep target trials that share a source recording')
+    parser.add_argument('--seed',dest='SEED',default=0,type=int,
+                        help='Random seed for sampling trials')
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.INDEX_PATH,index_col='index')
+
+    enroll_conditions = {'rooms':args.ENROLL_ROOMS,'mics':args.ENROLL_MICS,
+                         'distractors':args.ENROLL_DISTRACTORS}
+    test_conditions = {'rooms':args.TEST_ROOMS,'mics':args.TEST_MICS,
+                       'distractors':args.TEST_DISTRACTORS}
+    trials = build_trials(df,enroll_conditions=enroll_conditions,
+                          test_conditions=test_conditions,max_targets=args.MAX_TARGETS,
+                          nontarget_ratio=args.NONTARGET_RATIO,
+                          allow_same_source=args.ALLOW_SAME_SOURCE,seed=args.SEED)
+    print('Built {} target and {} non-target trials'.format(
+        int(trials['target'].sum()),int((trials['target']==0).sum())))
+    trials.to_csv(args.TRIALS_PATH,index=False)
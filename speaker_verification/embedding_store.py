@@ -0,0 +1,113 @@
+import os
+import json
+import numpy as np
+
+class EmbeddingStore:
+    """
+    An on-disk store of speaker embeddings, with one row per VOiCES recording
+    keyed by query_name.
+
+    A store is a directory holding four files:
+
+        header.json: The model fingerprint, embedding dimension, dtype and
+            number of rows
+        keys.txt: The query_name of each row, one per line
+        embeddings.npy: The (rows, dimension) embedding matrix
+        filled.npy: A boolean array marking which rows have been written
+
+    Both .npy files are memory mapped, so opening a store costs nothing and
+    the embedding matrix can be handed straight to the functions in
+    scoring.py.  keys.txt and embeddings.npy share the layout expected by the
+    -k and -e arguments of scoring.py.
+
+    # Arguments:
+        path: The path to the store directory
+        mode: 'r' to open read-only, 'r+' to allow writing embeddings
+    """
+    def __init__(self,path,mode='r'):
+        if mode not in ('r','r+'):
+            raise ValueError('Mode must be one of (\'r\', \'r+\')')
+        self.path = path
+        self.mode = mode
+        with open(os.path.join(path,'header.json')) as fin:
+            self.header = json.load(fin)
+        with open(os.path.join(path,'keys.txt')) as fin:
+            self.keys = [line.rstrip('\n') for line in fin]
+        self.key_to_row = {key: row for row,key in enumerate(self.keys)}
+        self.embeddings = np.load(os.path.join(path,'embeddings.npy'),mmap_mode=mode)
+        self.filled = np.load(os.path.join(path,'filled.npy'),mmap_mode=mode)
+        if self.embeddings.shape!=(len(self.keys),self.header['dim']):
+            raise ValueError('Embedding matrix shape does not match the store header')
+
+    @classmethod
+    def create(cls,path,keys,dim,fingerprint,dtype='float32'):
+        """
+        Creates an empty store on disk and opens it for writing
+
+        Arguments:
+            path: The path to the store directory, created if it does not exist
+            keys: List of query_names, one per row
+            dim: The embedding dimension
+            fingerprint: A string identifying the model that produced the
+                embeddings, see model_fingerprint in extract_embeddings.py
+            dtype: The dtype of the stored embeddings
+        """
+        keys = list(keys)
+        if len(set(keys))!=len(keys):
+            raise ValueError('Store keys must be unique')
+        os.makedirs(path,exist_ok=True)
+        embeddings = np.lib.format.open_memmap(os.path.join(path,'embeddings.npy'),mode='w+',
+                                               dtype=dtype,shape=(len(keys),dim))
+        del embeddings
+        filled = np.lib.format.open_memmap(os.path.join(path,'filled.npy'),mode='w+',
+                                           dtype=bool,shape=(len(keys),))
+        del filled
+        with open(os.path.join(path,'keys.txt'),'w') as fout:
+            fout.write(''.join(key+'\n' for key in keys))
+        # The header is written last, so a store is only valid once complete
+        header = {'fingerprint':fingerprint,'dim':int(dim),'dtype':np.dtype(dtype).name,
+                  'num_rows':len(keys)}
+        with open(os.path.join(path,'header.json'),'w') as fout:
+            json.dump(header,fout,indent=2)
+        return cls(path,mode='r+')
+
+    @staticmethod
+    def exists(path):
+        return os.path.isfile(os.path.join(path,'header.json'))
+
+    @property
+    def fingerprint(self):
+        return self.header['fingerprint']
+
+    @property
+    def dim(self):
+        return self.header['dim']
+
+    def missing_rows(self):
+        """
+        Returns the integer rows that have not been written yet
+        """
+        return np.flatnonzero(~self.filled)
+
+    def write(self,rows,values):
+        """
+        Writes embeddings into the given rows and marks them as filled.  The
+        embeddings are flushed to disk before the rows are marked, so a crash
+        never leaves a row marked as filled with missing data.
+        """
+        if self.mode!='r+':
+            raise ValueError('Store was opened read-only')
+        rows = np.asarray(rows,dtype=np.int64)
+        self.embeddings[rows] = values
+        self.embeddings.flush()
+        self.filled[rows] = True
+        self.filled.flush()
+
+    def rows_for(self,query_names):
+        """
+        Returns the integer rows for a list of query_names
+        """
+        return np.array([self.key_to_row[name] for name in query_names],dtype=np.int64)
+
+    def __len__(self):
+        return len(self.keys)
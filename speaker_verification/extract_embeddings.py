@@ -0,0 +1,224 @@
+"""
+This script computes a speaker embedding for every recording in a VOiCES index
+file and saves them to an EmbeddingStore, which can be passed directly to
+scoring.py.
+
+Recordings are loaded with VOiCES_SpeakerVerification and batched with
+PadSequence across a pool of DataLoader workers.  Batches are built from
+recordings of similar length, so little of each batch is padding.  The store
+is written after every batch and records a fingerprint of the model weights
+and window policy.  Rerunning the script with the same model and store will
+skip every recording that has already been embedded, so interrupted runs can
+be resumed, while running it with a different model is an error.
+
+The script takes in the following command line arguments
+
+-r : The absolute path to the root of the dataset
+-i : The absolute path to the VOiCES index file (.csv)
+-m : The path to a TorchScript model.  The model is called as
+    model(sequences_padded, lengths) with the outputs of PadSequence, and must
+    return a (batch size, embedding dimension) tensor.
+-o : The path to the embedding store directory
+-b : The batch size, defaults to 32
+-w : The number of DataLoader worker processes, defaults to 4
+-t : The number of files each worker reads concurrently with a
+    ConcurrentAudioLoader, defaults to 1, which reads them one after another
+--crop : Optional.  If set, only the central CROP seconds of each recording
+    are passed to the model
+--min_length, --max_length : Recordings outside this range of durations, in
+    seconds, are skipped.  Defaults to 0 and 30 seconds
+--device : The torch device to run the model on, defaults to cpu
+"""
+
+import argparse
+import hashlib
+import types
+import numpy as np
+import pandas as pd
+import torch
+from torch.utils.data import Dataset, DataLoader
+import tqdm
+from dataloaders.VOiCES_datasets import VOiCES_SpeakerVerification, PadSequence, ConcurrentAudioLoader
+from speaker_verification.embedding_store import EmbeddingStore
+
+class CenterCrop:
+    """
+    A window policy that keeps at most max_seconds of audio from the middle of
+    each recording.  Can be passed as the transform of
+    VOiCES_SpeakerVerification.
+    """
+    def __init__(self,max_seconds,sample_rate=16000):
+        self.max_seconds = max_seconds
+        self.sample_rate = sample_rate
+        self.max_samples = int(max_seconds*sample_rate)
+
+    def __call__(self,instance):
+        if instance.shape[0]<=self.max_samples:
+            return instance
+        start = (instance.shape[0]-self.max_samples)//2
+        return np.ascontiguousarray(instance[start:start+self.max_samples])
+
+    def __repr__(self):
+        return 'CenterCrop(max_seconds={}, sample_rate={})'.format(self.max_seconds,self.sample_rate)
+
+class _IndexedDataset(Dataset):
+    """
+    Wraps a VOiCES_SpeakerVerification dataset to return each item's position
+    in place of its label, so PadSequence hands back the positions of the
+    sorted batch
+    """
+    def __init__(self,dataset):
+        self.dataset = dataset
+
+    def __getitem__(self,index):
+        instance,_ = self.dataset[index]
+        return instance,index
+
+    def __getitems__(self,indices):
+        items = self.dataset.__getitems__(indices)
+        return [(instance,index) for (instance,_),index in zip(items,indices)]
+
+    def __len__(self):
+        return len(self.dataset)
+
+def policy_fingerprint(window_policy):
+    """
+    Returns a description of a window policy that is the same in every run.
+
+    A policy can define a fingerprint() method returning a string to control
+    this.  Otherwise functions are described by their qualified name, and
+    other objects by the qualified name of their class and the repr of each of
+    their attributes.  repr of the policy itself is not used, since by default
+    it includes a memory address.
+    """
+    if window_policy is None:
+        return 'None'
+    if hasattr(window_policy,'fingerprint'):
+        return str(window_policy.fingerprint())
+    if isinstance(window_policy,(types.FunctionType,types.BuiltinFunctionType)):
+        return '{}.{}'.format(window_policy.__module__,window_policy.__qualname__)
+    policy_type = type(window_policy)
+    attributes = sorted((name,repr(value)) for name,value in getattr(window_policy,'__dict__',{}).items())
+    return '{}.{}({})'.format(policy_type.__module__,policy_type.__qualname__,attributes)
+
+def model_fingerprint(model,window_policy=None):
+    """
+    Returns a hex digest identifying a model's class and weights, and the
+    window policy applied to its inputs
+    """
+    digest = hashlib.sha1()
+    digest.update(type(model).__name__.encode())
+    digest.update(policy_fingerprint(window_policy).encode())
+    for name,tensor in model.state_dict().items():
+        array = tensor.detach().cpu().contiguous().numpy()
+        digest.update(name.encode())
+        digest.update(str((array.shape,array.dtype.str)).encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+def length_buckets(durations,positions,batch_size):
+    """
+    Groups positions into batches of recordings with similar durations
+
+    Inputs:
+        durations - Array with the duration of every recording in the dataset
+        positions - Integer array of the positions to batch
+        batch_size - The maximum number of positions per batch
+    Outputs:
+        batches - A list of lists of positions
+    """
+    positions = np.asarray(positions,dtype=np.int64)
+    order = positions[np.argsort(durations[positions],kind='mergesort')]
+    return [order[i:i+batch_size].tolist() for i in range(0,len(order),batch_size)]
+
+def extract_embeddings(dataset_root,df,model,store_path,window_policy=None,batch_size=32,
+                       num_workers=4,min_length=0.0,max_length=30.0,device='cpu',loader=None):
+    """
+    Embeds every recording in an index that is not already in the store
+
+    Arguments:
+        dataset_root: The path to the root of the VOiCES dataset
+        df: A dataframe indexing the VOiCES dataset
+        model: A torch module called as model(sequences_padded, lengths),
+            returning a (batch size, embedding dimension) tensor
+        store_path: The path to the embedding store directory.  If a store
+            already exists there it is resumed, otherwise one is created.
+        window_policy: Callable applied to each (time, channels) waveform
+            before batching, e.g. CenterCrop.  None passes whole recordings.
+            It is identified in the store by policy_fingerprint.
+        batch_size: The maximum number of recordings per batch
+        num_workers: The number of DataLoader worker processes
+        min_length: Minimum duration, in seconds, of recordings to embed
+        max_length: Maximum duration, in seconds, of recordings to embed
+        device: The torch device to run the model on
+        loader: Optional ConcurrentAudioLoader, used to read the files of
+            each batch concurrently
+    Returns:
+        store: The EmbeddingStore, or None if there was nothing to embed
+    """
+    dataset = VOiCES_SpeakerVerification(dataset_root,df,min_length=min_length,
+                                         max_length=max_length,transform=window_policy,
+                                         loader=loader)
+    keys = dataset.df['query_name'].tolist()
+    fingerprint = model_fingerprint(model,window_policy)
+
+    store = None
+    positions = np.arange(len(keys))
+    if EmbeddingStore.exists(store_path):
+        store = EmbeddingStore(store_path,mode='r+')
+        if store.fingerprint!=fingerprint:
+            raise ValueError('Store at {} was built with a different model or window policy'.format(store_path))
+        if store.keys!=keys:
+            raise ValueError('Store at {} was built from a different index'.format(store_path))
+        positions = store.missing_rows()
+    print('{} of {} recordings left to embed'.format(len(positions),len(keys)))
+
+    batches = length_buckets(dataset.df['noisy_time'].values,positions,batch_size)
+    loader = DataLoader(_IndexedDataset(dataset),batch_sampler=batches,
+                        num_workers=num_workers,collate_fn=PadSequence())
+    model = model.to(device)
+    model.eval()
+    with torch.no_grad():
+        for sequences_padded,lengths,batch_positions in tqdm.tqdm(loader,total=len(batches)):
+            embeddings = model(sequences_padded.to(device),lengths.to(device))
+            embeddings = embeddings.detach().cpu().numpy()
+            if store is None:
+                store = EmbeddingStore.create(store_path,keys,embeddings.shape[1],fingerprint)
+            store.write(batch_positions.numpy(),embeddings)
+    return store
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r',dest='DATASET_ROOT',help='VOiCES dataset root',
+                        required=True,type=str)
+    parser.add_argument('-i',dest='INDEX_PATH',help='The absolute path to the index file',
+                        required=True,type=str)
+    parser.add_argument('-m',dest='MODEL',help='Path to the TorchScript embedding model',
+                        required=True,type=str)
+    parser.add_argument('-o',dest='STORE',help='Path to the embedding store directory',
+                        required=True,type=str)
+    parser.add_argument('-b',dest='BATCH_SIZE',help='batch size',
+                        default=32,type=int)
+    parser.add_argument('-w',dest='NUM_WORKERS',help='number of DataLoader workers',
+                        default=4,type=int)
+    parser.add_argument('-t',dest='IO_THREADS',help='number of files each worker reads concurrently',
+                        default=1,type=int)
+    parser.add_argument('--crop',dest='CROP',help='Seconds of audio to keep from the middle of each recording',
+                        default=None,type=float)
+    parser.add_argument('--min_length',dest='MIN_LENGTH',help='Minimum recording duration in seconds',
+                        default=0.0,type=float)
+    parser.add_argument('--max_length',dest='MAX_LENGTH',help='Maximum recording duration in seconds',
+                        default=30.0,type=float)
+    parser.add_argument('--device',dest='DEVICE',help='torch device to run the model on',
+                        default='cpu',type=str)
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.INDEX_PATH,index_col='index')
+    model = torch.jit.load(args.MODEL,map_location=args.DEVICE)
+    window_policy = CenterCrop(args.CROP) if args.CROP is not None else None
+    loader = ConcurrentAudioLoader(max_in_flight=args.IO_THREADS) if args.IO_THREADS>1 else None
+
+    extract_embeddings(args.DATASET_ROOT,df,model,args.STORE,window_policy=window_policy,
+                       batch_size=args.BATCH_SIZE,num_workers=args.NUM_WORKERS,
+                       min_length=args.MIN_LENGTH,max_length=args.MAX_LENGTH,
+                       device=args.DEVICE,loader=loader)
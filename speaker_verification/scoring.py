@@ -0,0 +1,232 @@
+"""
+This script scores a speaker verification trial list against a matrix of
+precomputed speaker embeddings, and reports the equal error rate (EER) and the
+minimum of the detection cost function (minDCF).
+
+Embeddings are read either from an EmbeddingStore directory, as written by
+extract_embeddings.py, or from a .npy file with one row per recording.  Either
+way the matrix is opened as a memory map so that only the rows used by the
+trials currently being scored are paged in.  Trials are scored in fixed size
+chunks, so the memory used is bounded by the chunk size rather than the length
+of the trial list.
+
+The script takes in the following command line arguments:
+
+-e: The absolute path to an embedding store directory, or to an embedding
+    matrix (.npy) of shape (number of recordings, embedding dimension)
+-k: Only needed when -e is a .npy file.  The absolute path to a text file with
+    the query_name of each row of the embedding matrix, one per line
+-t: The absolute path to the trial list (.csv), as produced by build_trials.py
+-o: Optional.  The absolute path for a .csv file with the score of every trial
+-c: The number of trials to score at a time, defaults to 100000
+-p: The prior probability of a target trial used for minDCF, defaults to 0.01
+"""
+
+import os
+import argparse
+import numpy as np
+import pandas as pd
+from speaker_verification.embedding_store import EmbeddingStore
+
+def load_keys(keys_path):
+    """
+    Reads a keys file, with one query_name per embedding row, into a dictionary
+    mapping each query_name to its row
+    """
+    with open(keys_path) as fin:
+        keys = [line.strip() for line in fin if line.strip()]
+    return {key: row for row,key in enumerate(keys)}
+
+def trial_rows(trials,key_to_row):
+    """
+    Looks up the embedding rows for the enrollment and test side of each trial
+
+    Inputs:
+        trials - A dataframe with enroll and test columns of query_names
+        key_to_row - A dictionary mapping query_name to embedding row
+    Outputs:
+        enroll_rows - Integer array of enrollment rows
+        test_rows - Integer array of test rows
+    """
+    key_index = pd.Index(list(key_to_row.keys()))
+    rows = np.fromiter(key_to_row.values(),dtype=np.int64,count=len(key_to_row))
+    enroll_pos = key_index.get_indexer(trials['enroll'])
+    test_pos = key_index.get_indexer(trials['test'])
+    missing = (enroll_pos<0) | (test_pos<0)
+    if missing.any():
+        raise KeyError('{} trials reference recordings with no embedding'.format(int(missing.sum())))
+    return rows[enroll_pos],rows[test_pos]
+
+def inverse_norms(embeddings,chunk_size=100000):
+    """
+    Computes the reciprocal L2 norm of every row of the embedding matrix,
+    reading it in chunks of rows
+    """
+    inv_norms = np.empty(embeddings.shape[0],dtype=np.float32)
+    for start in range(0,embeddings.shape[0],chunk_size):
+        block = np.asarray(embeddings[start:start+chunk_size],dtype=np.float32)
+        norms = np.sqrt(np.einsum('ij,ij->i',block,block))
+        inv_norms[start:start+chunk_size] = 1.0/np.maximum(norms,1e-12)
+    return inv_norms
+
+def cosine_score(embeddings,enroll_rows,test_rows,chunk_size=100000,inv_norms=None):
+    """
+    Computes the cosine similarity for every (enroll, test) pair of rows
+
+    Trials are processed chunk_size at a time.  Within a chunk, the unique
+    enrollment and test embeddings are gathered once and normalized.  When the
+    chunk is dense, i.e. the unique enrollment and test sets are small relative
+    to the number of trials, all pairwise scores are computed with a single
+    matrix multiply and the trial scores are gathered from the result.
+    Otherwise each trial is scored with a row-wise dot product.
+
+    Inputs:
+        embeddings - Array or memory map of shape (recordings, dimension)
+        enroll_rows - Integer array with the enrollment row of each trial
+        test_rows - Integer array with the test row of each trial
+        chunk_size - The number of trials scored at a time
+        inv_norms - Optional precomputed output of inverse_norms
+    Outputs:
+        scores - Float array with the cosine score of each trial
+    """
+    enroll_rows = np.asarray(enroll_rows,dtype=np.int64)
+    test_rows = np.asarray(test_rows,dtype=np.int64)
+    if inv_norms is None:
+        inv_norms = inverse_norms(embeddings,chunk_size=chunk_size)
+    scores = np.empty(len(enroll_rows),dtype=np.float32)
+    for start in range(0,len(enroll_rows),chunk_size):
+        stop = min(start+chunk_size,len(enroll_rows))
+        e_unique,e_inverse = np.unique(enroll_rows[start:stop],return_inverse=True)
+        t_unique,t_inverse = np.unique(test_rows[start:stop],return_inverse=True)
+        # Sorted row indices keep reads from a memory map sequential
+        e_block = np.asarray(embeddings[e_unique],dtype=np.float32)*inv_norms[e_unique,np.newaxis]
+        t_block = np.asarray(embeddings[t_unique],dtype=np.float32)*inv_norms[t_unique,np.newaxis]
+        if len(e_unique)*len(t_unique)<=4*(stop-start):
+            scores[start:stop] = np.matmul(e_block,t_block.T)[e_inverse,t_inverse]
+        else:
+            scores[start:stop] = np.einsum('ij,ij->i',e_block[e_inverse],t_block[t_inverse])
+    return scores
+
+def error_rates(scores,labels):
+    """
+    Computes the miss and false alarm rates at every possible threshold with a
+    single sort of the scores
+
+    Inputs:
+        scores - Float array of trial scores, higher means more likely target
+        labels - Array of trial labels, 1 for target and 0 for non-target
+    Outputs:
+        fnr - Miss rate at each threshold, in increasing order of threshold
+        fpr - False alarm rate at each threshold
+        thresholds - The thresholds, trials with score > threshold are accepted.
+            The first threshold accepts every trial and the last accepts none.
+    """
+    scores = np.asarray(scores,dtype=np.float64)
+    labels = np.asarray(labels).astype(bool)
+    num_targets = labels.sum()
+    num_nontargets = len(labels)-num_targets
+    if num_targets==0 or num_nontargets==0:
+        raise ValueError('Need both target and non-target trials')
+    order = np.argsort(scores,kind='mergesort')
+    sorted_scores = scores[order]
+    sorted_labels = labels[order]
+    # Number of targets and non-targets rejected when the threshold is placed
+    # just above each sorted score
+    rejected_targets = np.cumsum(sorted_labels)
+    rejected_nontargets = np.cumsum(~sorted_labels)
+    # Only the last position of each run of tied scores is a valid threshold
+    last_of_tie = np.append(sorted_scores[1:]!=sorted_scores[:-1],True)
+    fnr = np.concatenate([[0.0],rejected_targets[last_of_tie]/num_targets])
+    fpr = np.concatenate([[1.0],1.0-rejected_nontargets[last_of_tie]/num_nontargets])
+    thresholds = np.concatenate([[-np.inf],sorted_scores[last_of_tie]])
+    return fnr,fpr,thresholds
+
+def compute_eer(scores,labels):
+    """
+    Computes the equal error rate, interpolating linearly between the two
+    thresholds where the miss and false alarm rate curves cross
+
+    Outputs:
+        eer - The equal error rate, as a fraction
+        threshold - The threshold closest to the equal error point
+    """
+    fnr,fpr,thresholds = error_rates(scores,labels)
+    # fnr is non-decreasing and fpr is non-increasing, so their difference
+    # changes sign exactly once
+    idx = np.searchsorted(fnr-fpr,0.0)
+    if idx==0:
+        return fpr[0],thresholds[0]
+    if idx==len(fnr):
+        return fnr[-1],thresholds[-1]
+    d0 = fpr[idx-1]-fnr[idx-1]
+    d1 = fnr[idx]-fpr[idx]
+    alpha = d0/(d0+d1) if (d0+d1)>0 else 0.0
+    eer = fnr[idx-1]+alpha*(fnr[idx]-fnr[idx-1])
+    threshold = thresholds[idx] if alpha>=0.5 else thresholds[idx-1]
+    return eer,threshold
+
+def compute_min_dcf(scores,labels,p_target=0.01,c_miss=1.0,c_fa=1.0):
+    """
+    Computes the minimum of the normalized detection cost function over all
+    thresholds
+
+    Inputs:
+        scores - Float array of trial scores
+        labels - Array of trial labels, 1 for target and 0 for non-target
+        p_target - Prior probability of a target trial
+        c_miss - Cost of a miss
+        c_fa - Cost of a false alarm
+    Outputs:
+        min_dcf - The minimum normalized detection cost
+        threshold - The threshold achieving it
+    """
+    fnr,fpr,thresholds = error_rates(scores,labels)
+    dcf = c_miss*p_target*fnr+c_fa*(1-p_target)*fpr
+    dcf /= min(c_miss*p_target,c_fa*(1-p_target))
+    idx = np.argmin(dcf)
+    return dcf[idx],thresholds[idx]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-e',dest='EMBEDDINGS',help='Path to the embedding store or matrix (.npy)',
+                        required=True,type=str)
+    parser.add_argument('-k',dest='KEYS',help='Path to the query_name of each embedding row',
+                        default='none',type=str)
+    parser.add_argument('-t',dest='TRIALS',help='Path to the trial list',
+                        required=True,type=str)
+    parser.add_argument('-o',dest='OUTPUT',help='Output path for the trial scores',
+                        default='none',type=str)
+    parser.add_argument('-c',dest='CHUNK_SIZE',help='Number of trials to score at a time',
+                        default=100000,type=int)
+    parser.add_argument('-p',dest='P_TARGET',help='Target prior for minDCF',
+                        default=0.01,type=float)
+    args = parser.parse_args()
+
+    if os.path.isdir(args.EMBEDDINGS):
+        store = EmbeddingStore(args.EMBEDDINGS)
+        embeddings = store.embeddings
+        key_to_row = store.key_to_row
+    else:
+        if args.KEYS=='none':
+            raise ValueError('A keys file (-k) is needed with a .npy embedding matrix')
+        store = None
+        embeddings = np.load(args.EMBEDDINGS,mmap_mode='r')
+        key_to_row = load_keys(args.KEYS)
+    trials = pd.read_csv(args.TRIALS)
+
+    enroll_rows,test_rows = trial_rows(trials,key_to_row)
+    if store is not None:
+        unfilled = ~(store.filled[enroll_rows] & store.filled[test_rows])
+        if unfilled.any():
+            raise ValueError('{} trials reference recordings that have not been embedded yet'.format(int(unfilled.sum())))
+    scores = cosine_score(embeddings,enroll_rows,test_rows,chunk_size=args.CHUNK_SIZE)
+
+    eer,_ = compute_eer(scores,trials['target'].values)
+    min_dcf,_ = compute_min_dcf(scores,trials['target'].values,p_target=args.P_TARGET)
+    print('{} trials scored'.format(len(trials)))
+    print('EER: {:.2f}%'.format(100*eer))
+    print('minDCF (p_target={}): {:.4f}'.format(args.P_TARGET,min_dcf))
+
+    if args.OUTPUT!='none':
+        trials['score'] = scores
+        trials.to_csv(args.OUTPUT,index=False)